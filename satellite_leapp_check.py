@@ -23,8 +23,22 @@ import requests
 import argparse
 import configparser
 import socket
+import sys
 import getpass
 import subprocess
+import shlex
+import os
+import io
+import json
+import base64
+import contextlib
+import hashlib
+import tempfile
+from xml.etree import ElementTree
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib3.exceptions import InsecureRequestWarning
 
 LEAPP_VERSION = None
@@ -34,11 +48,49 @@ RHEL_ppc64le_REPOS = []
 # in the "NEW_CV_NAME" variable. Otherwise the content view assigned to
 # the host will be used.
 #NEW_CV_NAME = ""
-HTTP_CHECK = None
 USERNAME = None
 PASSWORD = None
 HOSTNAME = None
 SESSION = requests.Session()
+DEFAULT_CA_CERT = "/root/ssl-build/katello-server-ca.crt"
+# Number of clients checked at once on each Satellite when no concurrency cap is given
+DEFAULT_CLIENT_WORKERS = 8
+# Connections per Satellite when no concurrency cap is given: clients checked at
+# once times the leapp repositories each of them looks up concurrently
+DEFAULT_POOL_SIZE = DEFAULT_CLIENT_WORKERS*4
+# Remote execution job used to push the client checks to many hosts
+REX_JOB_TEMPLATE = 'Run Command - Script Default'
+# Prefix of the machine readable line printed by the client checks in --json mode
+REX_RESULT_MARKER = 'LEAPP_CHECK_RESULT: '
+REX_POLL_INTERVAL = 10
+REX_HOSTS_PER_PAGE = 1000
+# Consecutive failed polls of a job before its remaining hosts are given up on
+REX_POLL_MAX_ERRORS = 5
+# Host job statuses that mean the host has not finished running the job yet
+REX_RUNNING_STATES = ['n/a','pending','planned','planning','queued','running','scheduled']
+REDHAT_REPO = '/etc/yum.repos.d/redhat.repo'
+# Repository metadata downloaded ahead of the leapp upgrade with --prewarm-cache
+PREWARM_METADATA_TYPES = ['primary','filelists','modules']
+# dnf repository ids of the target repositories checked by check_leapp_repos_content()
+PREWARM_REPO_IDS = {
+    'appstream': 'rhel-8-for-x86_64-appstream-rpms',
+    'baseos': 'rhel-8-for-x86_64-baseos-rpms'
+}
+# None when no pre-warm was asked for, otherwise whether it succeeded
+PREWARM_STATUS = None
+PREWARM_WORKERS = 4
+PREWARM_CHUNK_SIZE = 1024*1024
+# HTTP status codes that tell us the Satellite (Puma/Postgres) is overloaded
+OVERLOAD_STATUS_CODES = [429,502,503]
+# Overload responses that are retried before being handed back to the caller.
+# Only 429/503 are retried for non-GET requests, a 502 may have been processed.
+API_RETRIES = 3
+API_TIMEOUT = 30
+# Passed to AdaptiveLimiter.release() instead of a status code when no response came back
+REQUEST_TIMED_OUT = 'timeout'
+REQUEST_FAILED = 'failed'
+API_RETRY_BACKOFF = 1
+API_RETRY_MAX_DELAY = 30
 SUCCESS = '✅'
 FAIL = '❌'
 LEAPP_MAJOR_RHEL_VERSIONS = [6,7,8]
@@ -88,6 +140,18 @@ ENABLE_LEAPP_REPOS = {
     }
 }
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be 1 or more, got "+str(value))
+    return number
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("must be greater than 0, got "+str(value))
+    return number
+
 parser = argparse.ArgumentParser(description="A script to enable, sync, and update content views for clients looking to leapp")
 parser.add_argument("-c","--client", action='store', type=str, help="The registered hostname of the RHEL client\n\n\n\n")
 parser.add_argument("-v","--version", action='store', type=str, help="The major and minor release you are leapping to. EX: \"8.6\"\n")
@@ -96,8 +160,185 @@ parser.add_argument("-p", "--password", action='store', type=str, default=None,
 # parser.add_argument("--newCV", action='store', type=str, default=None,
 #                     help="New content view name if user would like to create a new CV"
 #                     " instead of updating the current CV assigned to the host")
+parser.add_argument("--max-concurrency", action='store', type=positive_int, default=None,
+                    help="Hard cap on the number of concurrent Satellite API requests\n")
+parser.add_argument("--max-rps", action='store', type=positive_float, default=None,
+                    help="Maximum number of Satellite API requests per second\n")
+parser.add_argument("--config", action='store', type=str, default=None,
+                    help="INI file listing the Satellite servers, credentials and clients to check\n")
+parser.add_argument("--rex-search", action='store', type=str, default=None,
+                    help="Run the client checks through a remote execution job on the hosts matching this search\n")
+parser.add_argument("--json", action='store_true', default=False,
+                    help="Client mode only: finish with a machine readable result line\n")
+parser.add_argument("--prewarm-cache", action='store', type=str, default=None,
+                    help="Client mode only: download the target repositories' metadata into this directory, "
+                         "in dnf's cache layout. leapp does not read it by default, see the README\n")
 args = parser.parse_args()
 
+class AdaptiveLimiter:
+    '''
+    AIMD concurrency limiter placed in front of the Satellite API.
+    The limit grows by one after each window of requests whose p95 latency
+    stays close to the baseline p95, and is halved when the p95 latency
+    rises or when the Satellite answers with 429/502/503 or times out. The
+    baseline drops straight to a lower p95 and drifts up towards a higher one,
+    so the limit can grow again once latency settles at a new level.
+    acquire() returns a token for release(): overloads from requests that
+    started before the last decrease belong to the same congestion event and
+    do not halve the limit again.
+    '''
+    def __init__(self, initial=2, max_limit=None, max_rps=None, window=20, tolerance=1.5,
+                 baseline_decay=0.25):
+        self.limit = float(initial)
+        if max_limit:
+            self.limit = min(self.limit, max_limit)
+        self.max_limit = max_limit
+        self.max_rps = max_rps
+        self.window = window
+        self.tolerance = tolerance
+        self.baseline_decay = baseline_decay
+        self.in_flight = 0
+        self.peak = self.limit
+        self.requests = 0
+        self.overloads = 0
+        self.baseline_p95 = None
+        self.latencies = deque(maxlen=window)
+        self.decisions = []
+        self.next_start = 0.0
+        self.generation = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            token = self.generation
+            if self.max_rps:
+                # Reserve the next start slot so requests are spaced 1/max_rps apart
+                now = time.monotonic()
+                start = max(now, self.next_start)
+                self.next_start = start + 1.0/self.max_rps
+                delay = start - now
+            else:
+                delay = 0
+        if delay > 0:
+            time.sleep(delay)
+        return token
+
+    def release(self, latency, status_code=None, token=None):
+        with self.cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if status_code in OVERLOAD_STATUS_CODES or status_code == REQUEST_TIMED_OUT:
+                self.overloads += 1
+                if token is None or token == self.generation:
+                    self.latencies.clear()
+                    self._decrease('timeout' if status_code == REQUEST_TIMED_OUT else 'HTTP '+str(status_code))
+            elif status_code == REQUEST_FAILED:
+                # No response, so no latency worth sampling
+                pass
+            else:
+                self.latencies.append(latency)
+                if len(self.latencies) == self.window:
+                    self._evaluate()
+            self.cond.notify_all()
+
+    def _p95(self):
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95*(len(ordered)-1))]
+
+    def _evaluate(self):
+        p95 = self._p95()
+        self.latencies.clear()
+        if self.baseline_p95 is None or p95 < self.baseline_p95:
+            self.baseline_p95 = p95
+        baseline = self.baseline_p95
+        self.baseline_p95 += self.baseline_decay*(p95-baseline)
+        if p95 > baseline*self.tolerance:
+            self._decrease('p95 latency %.2fs above baseline %.2fs' % (p95, baseline))
+        elif not self.max_limit or self.limit < self.max_limit:
+            old = self.limit
+            self.limit += 1
+            if self.max_limit:
+                self.limit = min(self.limit, self.max_limit)
+            self.peak = max(self.peak, self.limit)
+            self.decisions.append(('increase', 'p95 latency %.2fs stable' % p95, int(old), int(self.limit)))
+
+    def _decrease(self, reason):
+        old = self.limit
+        self.generation += 1
+        self.limit = max(1.0, self.limit/2)
+        if int(old) != int(self.limit):
+            self.decisions.append(('decrease', reason, int(old), int(self.limit)))
+
+    def summary(self):
+        with self.cond:
+            increases = len([d for d in self.decisions if d[0] == 'increase'])
+            decreases = len([d for d in self.decisions if d[0] == 'decrease'])
+            print('Satellite API concurrency summary:')
+            print('\tRequests made: '+str(self.requests))
+            print('\tOverload responses (429/502/503/timeout): '+str(self.overloads))
+            print('\tConcurrency limit: final '+str(int(self.limit))+', peak '+str(int(self.peak))+
+                  (', cap '+str(self.max_limit) if self.max_limit else '')+
+                  (', max '+str(self.max_rps)+' req/s' if self.max_rps else ''))
+            print('\tLimit increases: '+str(increases)+', decreases: '+str(decreases))
+            for action, reason, old, new in self.decisions:
+                if action == 'decrease':
+                    print('\t- '+str(old)+' -> '+str(new)+': '+reason)
+
+class SatelliteServer:
+    '''
+    A Satellite server with its own credentials, CA bundle, connection pool
+    and concurrency limiter. Organization level API responses are cached so
+    they are only fetched once per server, no matter how many clients use them.
+    '''
+    def __init__(self, name, hostname, username, password, ca_cert=DEFAULT_CA_CERT,
+                 clients=None, max_concurrency=None, max_rps=None, local=False):
+        if not hostname.startswith('http://') and not hostname.startswith('https://'):
+            hostname = 'https://'+hostname
+        self.name = name
+        self.url = hostname.rstrip('/')
+        self.username = username
+        self.password = password
+        self.ca_cert = ca_cert
+        # The Satellite this script runs on, where hammer is already configured
+        self.local = local
+        self.clients = clients or []
+        self.max_concurrency = max_concurrency
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.verify = ca_cert
+        pool_size = max_concurrency or DEFAULT_POOL_SIZE
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Never let more requests in flight than the pool has connections
+        self.limiter = AdaptiveLimiter(max_limit=pool_size, max_rps=max_rps)
+        self.cache = {}
+        self.cache_locks = {}
+        self.lock = threading.Lock()
+
+    def get_cached_json(self, endpoint):
+        with self.lock:
+            if endpoint in self.cache:
+                return self.cache[endpoint]
+            endpoint_lock = self.cache_locks.setdefault(endpoint, threading.Lock())
+        # Only one thread fetches a given endpoint, the others wait for its answer
+        with endpoint_lock:
+            with self.lock:
+                if endpoint in self.cache:
+                    return self.cache[endpoint]
+            # Failed responses are not cached, the next client asks again
+            data = response_json(self, api_call(self, endpoint))
+            with self.lock:
+                self.cache[endpoint] = data
+            return data
+
+    def forget(self, endpoint):
+        with self.lock:
+            self.cache.pop(endpoint, None)
+
 def get_username():
     global USERNAME
     if args.username:
@@ -119,6 +360,62 @@ def get_hostname():
     HOSTNAME = 'https://'+str(socket.getfqdn())
     return HOSTNAME
 
+def read_config(path):
+    '''
+    Read the Satellite servers from an INI file, one section per server:
+
+    [satellite1]
+    hostname = satellite1.example.com
+    username = admin
+    password = changeme
+    ca_cert = /etc/pki/satellite1-ca.crt
+    clients = client1.example.com, client2.example.com
+    max_concurrency = 8
+    max_rps = 20
+    '''
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        print(FAIL+" Unable to read the configuration file: "+path)
+        exit(1)
+    servers = []
+    for name in config.sections():
+        section = config[name]
+        if not section.get('hostname'):
+            print(FAIL+" Server ["+name+"] in "+path+" has no hostname")
+            exit(1)
+        # Without a ca_cert the system CA bundle is used
+        ca_cert = section.get('ca_cert', True)
+        if ca_cert is not True and ca_cert.lower() in ['false','no']:
+            requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+            ca_cert = False
+        elif ca_cert is not True and not os.path.isfile(ca_cert):
+            print(FAIL+" Server ["+name+"] in "+path+" has a ca_cert that does not exist: "+ca_cert)
+            exit(1)
+        clients = [client.strip() for client in section.get('clients', '').split(',') if client.strip()]
+        if args.client and args.client not in clients:
+            clients.append(args.client)
+        try:
+            max_concurrency = section.get('max_concurrency')
+            max_concurrency = positive_int(max_concurrency) if max_concurrency else args.max_concurrency
+            max_rps = section.get('max_rps')
+            max_rps = positive_float(max_rps) if max_rps else args.max_rps
+        except (ValueError, argparse.ArgumentTypeError) as error:
+            print(FAIL+" Server ["+name+"] in "+path+" has an invalid limit: "+str(error))
+            exit(1)
+        # Prompted for once and shared by every section that leaves them out
+        username = section.get('username') or USERNAME or get_username()
+        password = section.get('password') or PASSWORD or get_password()
+        if not username or not password:
+            print(FAIL+" Server ["+name+"] in "+path+" has no username or password")
+            print("\tPlease set them in the section or with the -u and -p options")
+            exit(1)
+        servers.append(SatelliteServer(name, section['hostname'], username, password,
+                                       ca_cert, clients, max_concurrency, max_rps))
+    if len(servers) == 0:
+        print(FAIL+" No Satellite servers found in the configuration file: "+path)
+        exit(1)
+    return servers
+
 def usage():
     print()
     print('Thanks for using satellite_leapp_check.')
@@ -199,42 +496,108 @@ def determine_leapp_repos(arch):
         print("\thttps://access.redhat.com/documentation/en-us/red_hat_enterprise_linux/8/html-single/upgrading_from_rhel_7_to_rhel_8/index#planning-an-upgrade_upgrading-from-rhel-7-to-rhel-8")
         exit(1)
 
-def api_call(url, username, password):
-    # given the url, username and password make the API call
-    global HTTP_CHECK
-    if not HTTP_CHECK:
+def check_satellite_connection(server):
+    # Make sure the Satellite answers before sending it any API calls
+    try:
+        response = server.session.get(server.url, timeout=30)
+        response.raise_for_status()
+    except (requests.exceptions.RequestException, OSError) as error:
+        print(FAIL+" A request test to the Satellite at: "+
+              server.url+" failed with the following error: ")
+        print(f"An error occurred: {error}")
+        exit(1)
+
+def retry_delay(response, attempt):
+    # Honour the Satellite's Retry-After when it gives one in seconds
+    try:
+        delay = float(response.headers.get('Retry-After'))
+    except (AttributeError, TypeError, ValueError):
+        delay = API_RETRY_BACKOFF*2**attempt
+    return min(max(delay, 0), API_RETRY_MAX_DELAY)
+
+def api_call(server, endpoint, method='GET', params=None, data=None):
+    # given the server and endpoint make the API call
+    # A timed out GET is retried like an overload, a timed out POST may have been processed
+    retry_codes = OVERLOAD_STATUS_CODES+[REQUEST_TIMED_OUT] if method == 'GET' else [429,503]
+    for attempt in range(API_RETRIES+1):
+        token = server.limiter.acquire()
+        start = time.monotonic()
+        status_code = REQUEST_FAILED
+        response = None
         try:
-            RESPONSE = requests.get("https://"+socket.getfqdn(), timeout=30)
-            if RESPONSE.ok:
-                HTTP_CHECK = True
-        except requests.exceptions.RequestException as error:
-            print(FAIL+" A request test to the Satellite at: https://"+
-                  str(socket.getfqdn())+" failed with the following error: ")
-            print(f"An error occurred: {error}")
-            exit(1)
-    SESSION.auth = (username, password)
-    response = SESSION.get(url, verify="/root/ssl-build/katello-server-ca.crt")
-    return response
+            response = server.session.request(method, server.url+endpoint, params=params, json=data,
+                                              timeout=API_TIMEOUT)
+            status_code = response.status_code
+        except requests.exceptions.Timeout:
+            status_code = REQUEST_TIMED_OUT
+            if REQUEST_TIMED_OUT not in retry_codes or attempt == API_RETRIES:
+                raise
+        finally:
+            server.limiter.release(time.monotonic()-start, status_code, token)
+        if status_code not in retry_codes or attempt == API_RETRIES:
+            return response
+        time.sleep(retry_delay(response, attempt))
+
+def response_json(server, response):
+    # Turn a failed or non JSON API response into an exit() like the other checks
+    if not response.ok:
+        print(FAIL+" "+server.url+" answered HTTP "+str(response.status_code)+" to "+response.url)
+        exit(1)
+    try:
+        return response.json()
+    except ValueError:
+        print(FAIL+" "+server.url+" did not answer with JSON to "+response.url)
+        exit(1)
 
-def search_for_host():
+def search_for_host(server, client_name):
     # Make the call for the client value on the Satellite
-    if args.client:
-        print('Searching for host '+args.client)
+    if client_name:
+        print('Searching for host '+client_name+' on '+server.url)
         endpoint = '/api/hosts/'
         try:
-            client = api_call(HOSTNAME+endpoint+args.client, USERNAME, PASSWORD)
+            client = api_call(server, endpoint+client_name)
         except requests.exceptions.RequestException as error:
             print(f"An error occurred: {error}")
-        return client.json()
+            exit(1)
+        if client.status_code == 404:
+            print(FAIL+" Host "+client_name+" is not registered to "+server.url)
+            return None
+        return response_json(server, client)
     else:
         print(FAIL+" No client value given")
         print("\tPlease provide a client value with the command")
         print("\tExample: \"satellite_leapp_check -c client.example.com\"")
         exit(1)
 
-def enable_leapp_repos(org_id, arch, LEAPP_VERSION,sub_arch=None):
+def write_hammer_config(server):
+    # Keep the credentials off the command line, mkstemp creates the file as 0600
+    fd, path = tempfile.mkstemp(prefix='hammer-', suffix='.yml')
+    with os.fdopen(fd, 'w') as config_file:
+        config_file.write(':foreman:\n')
+        config_file.write('  :host: '+json.dumps(server.url)+'\n')
+        config_file.write('  :username: '+json.dumps(server.username)+'\n')
+        config_file.write('  :password: '+json.dumps(server.password)+'\n')
+        if server.ca_cert is False:
+            config_file.write(':ssl:\n  :verify_ssl: false\n')
+        elif server.ca_cert is not True:
+            config_file.write(':ssl:\n  :ssl_ca_file: '+json.dumps(server.ca_cert)+'\n')
+    return path
+
+def enable_leapp_repos(server, org_id, arch, LEAPP_VERSION,sub_arch=None):
     # Run commands to enable leapp_repos on the Satellite
-    command = 'hammer repository-set enable '
+    if server.local:
+        # hammer's own configuration already points at this Satellite
+        hammer_enable_leapp_repos('hammer ', org_id, arch, LEAPP_VERSION, sub_arch)
+        return
+    config_path = write_hammer_config(server)
+    try:
+        hammer_enable_leapp_repos('hammer --config '+shlex.quote(config_path)+' ',
+                                  org_id, arch, LEAPP_VERSION, sub_arch)
+    finally:
+        os.remove(config_path)
+
+def hammer_enable_leapp_repos(hammer, org_id, arch, LEAPP_VERSION, sub_arch=None):
+    command = hammer+'repository-set enable '
     name = '--name '
     release = '--releasever '
     basearch = '--basearch '
@@ -305,10 +668,11 @@ def sync_leapp_repos(org_id, arch, releasever, leapp_repos):
     # Not available until RFE 2240648
     pass
 
-def check_org_for_leapp_repos(org_id, leapp_repos):
-    endpoint = '/katello/api/organizations/'+str(org_id)+'/repositories'
-    repo_call = api_call(HOSTNAME+endpoint, USERNAME, PASSWORD)
-    repos = repo_call.json()
+def org_repos_endpoint(org_id):
+    return '/katello/api/organizations/'+str(org_id)+'/repositories'
+
+def check_org_for_leapp_repos(server, org_id, leapp_repos):
+    repos = server.get_cached_json(org_repos_endpoint(org_id))
     repo_name = []
     for repo in repos['results']:
         repo_name.append(repo['name'])
@@ -320,15 +684,14 @@ def check_org_for_leapp_repos(org_id, leapp_repos):
             missing_repos.append(repo)
     if len(missing_repos) > 0:
         for repo in missing_repos:
-            print(FAIL+" Organization ID "+str(org_id)+" is missing "+repo)
+            print(FAIL+" Organization ID "+str(org_id)+" on "+server.name+" is missing "+repo)
             return False
     else:
         return True
     
-def check_cv_for_leapp_repos(cv,leapp_repos):
+def check_cv_for_leapp_repos(server,cv,leapp_repos):
     endpoint = '/katello/api/content_view_versions/'+str(cv)
-    cv_call = api_call(HOSTNAME+endpoint, USERNAME, PASSWORD)
-    cv_info = cv_call.json()
+    cv_info = server.get_cached_json(endpoint)
     repos = cv_info['repositories']
     repo_names = []
     missing_repos = []
@@ -340,29 +703,28 @@ def check_cv_for_leapp_repos(cv,leapp_repos):
         else:
             missing_repos.append(repo)
     if len(missing_repos) > 0:
-        print(FAIL+" Content View ("+HOSTNAME+"/content_views/"+str(cv_info['content_view_id'])+"#/versions) is missing the following repositories:")
+        print(FAIL+" Content View ("+server.url+"/content_views/"+str(cv_info['content_view_id'])+"#/versions) is missing the following repositories:")
         for repo in missing_repos:
             print(" - "+repo)
         exit(1)
     else:
         return True
     
-def check_repos_for_content(cv_id,leapp_repos,client_lce):
+def get_repo_content(server, repo):
+    endpoint = '/katello/api/repositories/'+str(repo['id'])
+    return server.get_cached_json(endpoint)
+
+def check_repos_for_content(server,cv_id,leapp_repos,client_lce):
     endpoint = '/katello/api/content_view_versions/'+str(cv_id)
-    cv_call = api_call(HOSTNAME+endpoint, USERNAME, PASSWORD)
-    cv_info = cv_call.json()
+    cv_info = server.get_cached_json(endpoint)
     empty_repos = []
-    for repo in cv_info['repositories']:
-        if repo['name'] in leapp_repos:
-            endpoint = '/katello/api/repositories/'+str(repo['id'])
-            repo_content_call = api_call(HOSTNAME+endpoint,USERNAME,PASSWORD)
-            repo_content = repo_content_call.json()
+    check_repos = [repo for repo in cv_info['repositories'] if repo['name'] in leapp_repos]
+    # The limiter decides how many of these requests actually run at once
+    with ThreadPoolExecutor(max_workers=max(1, len(check_repos))) as executor:
+        repo_contents = executor.map(lambda repo: get_repo_content(server, repo), check_repos)
+        for repo, repo_content in zip(check_repos, repo_contents):
             if repo_content['content_counts']['rpm'] == 0:
                 empty_repos.append(repo['name'])
-            else:
-                continue
-        else:
-            continue
     if len(empty_repos) > 0:
         print(FAIL+" The following repos were found to have 0 RPMs")
         for repo in empty_repos:
@@ -464,23 +826,21 @@ we need to check:
 def sub_man_refresh():
     try:
         cmd = ['subscription-manager','refresh']
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        #o, e = proc.communicate()
-
-        if proc.returncode == 0:
-            #print(o.decode('UTF-8'))
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode == 0:
             return True
         else:
-            #print(e.decode('UTF-8'))
+            print(FAIL+"The command 'subscription-manager refresh' returned an error!")
+            print(result.stderr.decode('UTF-8'))
             return False
-    except requests.exceptions.RequestException as error:
+    except OSError as error:
         print(FAIL+"The command 'subscription-manager refresh' returned an error!")
         print(error)
         return False
     
 def release_unset():
     cmd = ['subscription-manager','release','--unset']
-    subprocess.call(cmd, shell=True)
+    subprocess.call(cmd)
     
 def get_os_major():
     major = open('/etc/redhat-release','r').read().split(' ')[5].split('.')[0]
@@ -516,10 +876,10 @@ def enable_repos(major):
     try:
         if major == '7':
             cmd = ['subscription-manager','repos','--enable','rhel-7-server-rpms','--enable','rhel-7-server-extras-rpms']
-            subprocess.call(cmd, shell=True)
+            subprocess.call(cmd)
         elif major == '8':
             cmd = ['subscription-manager','repos','--enable','rhel-8-for-x86_64-appstream-rpms','--enable','rhel-8-for-x86_64-baseos-rpms']
-            subprocess.call(cmd, shell=True)
+            subprocess.call(cmd)
     except requests.exceptions.RequestException as error:
         print(FAIL+"Failed to enable RHEL 7 repositories")
         print(error)
@@ -538,7 +898,7 @@ def determine_leapp_version_release_avail(LEAPP_VERSION):
 def repo_file_check(repo_label):
     try:
         config = configparser.ConfigParser()
-        config.read('/etc/yum.repos.d/redhat.repo')
+        config.read(REDHAT_REPO)
         rh_repo_conf = {}
         rh_repo_conf['sslclientcert'] = config[repo_label]['sslclientcert']
         rh_repo_conf['sslclientkey'] = config[repo_label]['sslclientkey']
@@ -546,28 +906,145 @@ def repo_file_check(repo_label):
         rh_repo_conf['serverurl'] = config[repo_label]['baseurl'][:config[repo_label]['baseurl'].find("dist")]
         return rh_repo_conf
     except requests.exceptions.RequestException as error:
-        print(FAIL+"Failed to parse file /etc/yum.repos.d/redhat.repo")
+        print(FAIL+"Failed to parse file "+REDHAT_REPO)
         print(error)
         exit(1)
 
 def check_leapp_repos_content(LEAPP_VERSION):
+    # Returns the repomd.xml response of each target repository
     try:
         if LEAPP_VERSION in ['8.6','8.8','8.9','8.10']:
             rh_repo_conf = repo_file_check('rhel-7-server-rpms')
+            repomds = {}
             for repo in ['appstream','baseos']:
                 response = SESSION.get(rh_repo_conf['serverurl']+
                                     'dist/rhel8/'+LEAPP_VERSION+'/x86_64/'+repo+'/os/repodata/repomd.xml',
-                                    verify="/root/ssl-build/katello-server-ca.crt",
+                                    verify=rh_repo_conf['sslcacert'],
                                     cert=(rh_repo_conf['sslclientcert'],rh_repo_conf['sslclientkey']))
-                if response.status_code != '200':
+                if response.status_code != 200:
                     print(FAIL+"Failed to retrieve the repomd.xml from the "+repo+" repository")
                     exit(1)
-                else:
-                    return response
+                repomds[repo] = response
+            return repomds
     except requests.exceptions.RequestException as error:
         print(error)
         exit(1)
 
+'''
+Pre-warm the target repositories' metadata before the leapp maintenance window.
+The files listed in each repomd.xml are downloaded into dnf's cache layout,
+<cachedir>/<repoid>-<hash>/repodata/, next to the repomd.xml itself, which is
+only written once every file matched its checksum. Files already in the cache
+with a matching checksum are skipped and interrupted downloads are resumed with
+HTTP range requests.
+'''
+def dnf_cache_dir(cache_dir, repo_id, baseurl):
+    # dnf names a repository's cache after its id and the sha256 of its first baseurl
+    digest = hashlib.sha256(baseurl.encode('UTF-8')).hexdigest()
+    return os.path.join(cache_dir, repo_id+'-'+digest[:16])
+
+def target_repo_baseurl(repo_id, LEAPP_VERSION, repomd_url):
+    '''
+    The baseurl dnf will hash for the target repository: the first baseurl of
+    its section in redhat.repo with the variables substituted. Without such a
+    section, the URL the repomd.xml was fetched from, which is the baseurl
+    leapp builds for its target repositories.
+    '''
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(REDHAT_REPO)
+    if config.has_option(repo_id, 'baseurl'):
+        baseurl = config[repo_id]['baseurl'].replace(',', ' ').split()[0]
+        for variable, value in [('releasever', LEAPP_VERSION), ('basearch', 'x86_64')]:
+            baseurl = baseurl.replace('${'+variable+'}', value).replace('$'+variable, value)
+        return baseurl
+    return repomd_url[:repomd_url.rfind('/repodata/repomd.xml')]
+
+def parse_repomd(repomd):
+    ns = {'repo': 'http://linux.duke.edu/metadata/repo'}
+    files = []
+    for data in ElementTree.fromstring(repomd).findall('repo:data', ns):
+        if data.get('type') in PREWARM_METADATA_TYPES:
+            checksum = data.find('repo:checksum', ns)
+            files.append({
+                'type': data.get('type'),
+                'href': data.find('repo:location', ns).get('href'),
+                'checksum_type': checksum.get('type'),
+                'checksum': checksum.text.strip()
+            })
+    return files
+
+def file_checksum(path, checksum_type):
+    # createrepo uses "sha" for sha1
+    digest = hashlib.new('sha1' if checksum_type == 'sha' else checksum_type)
+    with open(path, 'rb') as metadata_file:
+        for chunk in iter(lambda: metadata_file.read(PREWARM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def download_metadata(rh_repo_conf, base_url, repo_dir, entry):
+    path = os.path.join(repo_dir, entry['href'])
+    if os.path.exists(path) and file_checksum(path, entry['checksum_type']) == entry['checksum']:
+        return 'cached'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path+'.part'
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    headers = {'Range': 'bytes='+str(offset)+'-'} if offset else {}
+    with SESSION.get(base_url+entry['href'], headers=headers, stream=True, timeout=60,
+                     verify=rh_repo_conf['sslcacert'],
+                     cert=(rh_repo_conf['sslclientcert'],rh_repo_conf['sslclientkey'])) as response:
+        # 416 means the partial file already holds everything, the checksum below decides
+        if response.status_code != 416:
+            response.raise_for_status()
+            # A 200 instead of a 206 means the server ignored the range, start over
+            with open(partial, 'ab' if response.status_code == 206 else 'wb') as metadata_file:
+                for chunk in response.iter_content(PREWARM_CHUNK_SIZE):
+                    metadata_file.write(chunk)
+    if file_checksum(partial, entry['checksum_type']) != entry['checksum']:
+        os.remove(partial)
+        raise ValueError(entry['checksum_type']+' checksum mismatch')
+    os.replace(partial, path)
+    return 'resumed' if offset else 'downloaded'
+
+def prewarm_leapp_repos(repomds, cache_dir, LEAPP_VERSION):
+    rh_repo_conf = repo_file_check('rhel-7-server-rpms')
+    jobs = []
+    repo_dirs = {}
+    for repo, response in repomds.items():
+        base_url = response.url[:response.url.rfind('repodata/repomd.xml')]
+        repo_id = PREWARM_REPO_IDS[repo]
+        repo_dir = dnf_cache_dir(cache_dir, repo_id, target_repo_baseurl(repo_id, LEAPP_VERSION, response.url))
+        repo_dirs[repo] = repo_dir
+        for entry in parse_repomd(response.content):
+            jobs.append((repo, base_url, repo_dir, entry))
+    def download(job):
+        repo, base_url, repo_dir, entry = job
+        try:
+            return download_metadata(rh_repo_conf, base_url, repo_dir, entry)
+        except (requests.exceptions.RequestException, OSError, ValueError) as error:
+            return error
+    print("Pre-warming the target repositories' metadata in "+cache_dir)
+    failed_repos = set()
+    with ThreadPoolExecutor(max_workers=PREWARM_WORKERS) as executor:
+        for (repo, base_url, repo_dir, entry), result in zip(jobs, executor.map(download, jobs)):
+            if isinstance(result, Exception):
+                failed_repos.add(repo)
+                print(FAIL+"Failed to pre-warm the "+entry['type']+" metadata of the "+repo+" repository: "+str(result))
+            else:
+                print(SUCCESS+" "+repo+" "+entry['type']+" metadata "+result)
+    for repo, response in repomds.items():
+        if repo not in failed_repos:
+            # Written last so a cached repomd.xml always points at verified files
+            repomd_path = os.path.join(repo_dirs[repo], 'repodata', 'repomd.xml')
+            try:
+                os.makedirs(os.path.dirname(repomd_path), exist_ok=True)
+                with open(repomd_path+'.part', 'wb') as repomd_file:
+                    repomd_file.write(response.content)
+                os.replace(repomd_path+'.part', repomd_path)
+            except OSError as error:
+                failed_repos.add(repo)
+                print(FAIL+"Failed to write the repomd.xml of the "+repo+" repository: "+str(error))
+    return len(failed_repos) == 0
+
 def resolve_rhsm_hostname():
     return
 
@@ -575,6 +1052,7 @@ def reach_rhsm_hostname():
     return
 
 def check_client():
+    global PREWARM_STATUS
     LEAPP_VERSION = get_leapp_version()
     if resolve_rhsm_hostname():
         if sub_man_refresh():
@@ -584,12 +1062,16 @@ def check_client():
                 verify_latest_release_avail('7Server')
                 enable_repos(major)
                 determine_leapp_version_release_avail(LEAPP_VERSION)
-                check_leapp_repos_content(LEAPP_VERSION)
+                repomds = check_leapp_repos_content(LEAPP_VERSION)
+                if args.prewarm_cache:
+                    PREWARM_STATUS = prewarm_leapp_repos(repomds, args.prewarm_cache, LEAPP_VERSION)
             elif major == '8':
                 verify_latest_release_avail('8')
                 enable_repos(major)
                 determine_leapp_version_release_avail(LEAPP_VERSION)
-                check_leapp_repos_content(LEAPP_VERSION)
+                repomds = check_leapp_repos_content(LEAPP_VERSION)
+                if args.prewarm_cache:
+                    PREWARM_STATUS = prewarm_leapp_repos(repomds, args.prewarm_cache, LEAPP_VERSION)
             else:
                 print(FAIL+"OS major version can not be determined")
                 print("\tOS major release determined from /etc/os-release file")
@@ -599,6 +1081,10 @@ def check_client():
         else:
             exit(1)
     print(SUCCESS+"Your client is ready to Leapp!")
+    if PREWARM_STATUS is False:
+        # Not a blocker, leapp downloads whatever is missing during the upgrade
+        print(FAIL+"Pre-warming the target repositories' metadata failed, "
+              "leapp will download it during the upgrade")
 
 def resolve_rhsm_hostname():
     requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
@@ -649,8 +1135,10 @@ def get_client_lce(client):
         client_lce = client['content_facet_attributes']['lifecycle_environment']['name']
     return client_lce
 
-def parse_client():
-    client = search_for_host()
+def parse_client(server, client_name):
+    client = search_for_host(server, client_name)
+    if client is None:
+        return None
     client_lce = get_client_lce(client)
     arch = parse_for_arch(client)
     if arch == 'x86_64':
@@ -665,38 +1153,43 @@ def parse_client():
                 exit(1)
             else:
                 org_id = parse_for_organization(client)
-                if check_org_for_leapp_repos(org_id,leapp_repos):
+                if check_org_for_leapp_repos(server,org_id,leapp_repos):
                     print(SUCCESS+" Organization ID "+str(org_id)+" has the required repos enabled")
                     print("Checking client's content view for repo availability")
                     cv,cv_id = parse_for_content_view(client)
                     if cv != "Default Organization View":
-                        if check_cv_for_leapp_repos(cv_id,leapp_repos):
+                        if check_cv_for_leapp_repos(server,cv_id,leapp_repos):
                             print(SUCCESS+" Content View Version ID "+cv+" has the required repositories for leapp upgrade")
                             print("Checking that the repos contain content")
-                            if check_repos_for_content(cv_id,leapp_repos,client_lce):
+                            if check_repos_for_content(server,cv_id,leapp_repos,client_lce):
                                 print(SUCCESS+" Congratulations!!! "+client['name']+' is ready to LEAPP')
+                                return True
                     else:
                         print("You are using the Default Organization View")
                         print("Checking that the repos contain content")
-                        if check_repos_for_content(cv_id,leapp_repos,client_lce):
+                        if check_repos_for_content(server,cv_id,leapp_repos,client_lce):
                             print(SUCCESS+" Congratulations!!! "+client['name']+' is ready to LEAPP')
+                            return True
                 else:
-                    enable_leapp_repos(org_id, arch, LEAPP_VERSION, leapp_repos)
-                    if check_org_for_leapp_repos(org_id,leapp_repos):
+                    enable_leapp_repos(server, org_id, arch, LEAPP_VERSION, leapp_repos)
+                    server.forget(org_repos_endpoint(org_id))
+                    if check_org_for_leapp_repos(server,org_id,leapp_repos):
                         print(SUCCESS+" Organization ID "+str(org_id)+" has the required repos enabled")
                         print("Checking client's content view for repo availability")
                         cv,cv_id = parse_for_content_view(client)
                         if cv != "Default Organization View":
-                            if check_cv_for_leapp_repos(cv_id,leapp_repos):
+                            if check_cv_for_leapp_repos(server,cv_id,leapp_repos):
                                 print(SUCCESS+" Content View Version ID "+cv+" has the required repositories for leapp upgrade")
                                 print("Checking that the repos contain content")
-                            if check_repos_for_content(cv_id,leapp_repos,client_lce):
+                            if check_repos_for_content(server,cv_id,leapp_repos,client_lce):
                                 print(SUCCESS+" Congratulations!!! "+client['name']+' is ready to LEAPP')
+                                return True
                         else:
                             print("You are using the Default Organization View")
                             print("Checking that the repos contain content")
-                            if check_repos_for_content(cv_id,leapp_repos,client_lce):
+                            if check_repos_for_content(server,cv_id,leapp_repos,client_lce):
                                 print(SUCCESS+" Congratulations!!! "+client['name']+' is ready to LEAPP')
+                                return True
         else:
             print(FAIL+" Required major version detection failed")
             print('\tMajor version should be:')
@@ -705,20 +1198,370 @@ def parse_client():
             print(f'\tSatellite API shows your client\'s major version as {major_version}')
             print("\tCheck the client's facts for a 'distribution::version")
             exit(1)
+    return False
+
+class ThreadOutput:
+    '''
+    Stand-in for sys.stdout that sends a thread's output to its own buffer
+    while that thread captures it, so concurrent client checks don't
+    interleave their messages.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        with self.lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @contextlib.contextmanager
+    def capture(self):
+        self.local.buffer = io.StringIO()
+        try:
+            yield self.local.buffer
+        finally:
+            self.local.buffer = None
+
+def failure_lines(output):
+    return [line.replace(FAIL, '').strip() for line in output.splitlines() if FAIL in line]
+
+def check_host(server, client_name):
+    # Run the client checks, turning an exit() or error into a failed verdict for this host only
+    try:
+        return parse_client(server, client_name)
+    except SystemExit:
+        return False
+    except Exception as error:
+        print(FAIL+" Checking "+client_name+" on "+server.name+" failed with the following error: ")
+        print(f"An error occurred: {error!r}")
+        return False
+
+def check_host_output(server, client_name):
+    # Check a host with its output kept together and printed as one block
+    if not isinstance(sys.stdout, ThreadOutput):
+        ready = check_host(server, client_name)
+        return ready, []
+    with sys.stdout.capture() as output:
+        ready = check_host(server, client_name)
+    block = '\n=== '+client_name+' on '+server.name+' ===\n'+output.getvalue()
+    with sys.stdout.lock:
+        sys.stdout.stream.write(block)
+    return ready, failure_lines(output.getvalue())
+
+def check_server(server):
+    if len(server.clients) == 0:
+        print(FAIL+" No clients listed for Satellite "+server.name)
+        return []
+    try:
+        check_satellite_connection(server)
+    except (SystemExit, Exception):
+        return [(server, client_name, False, [server.url+' can not be reached'])
+                for client_name in server.clients]
+    workers = min(len(server.clients), server.max_concurrency or DEFAULT_CLIENT_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        verdicts = executor.map(lambda client_name: check_host_output(server, client_name), server.clients)
+        return [(server, client_name, ready, failures)
+                for client_name, (ready, failures) in zip(server.clients, verdicts)]
+
+def check_servers(servers):
+    # Check every Satellite at the same time and merge the results into one report
+    stdout = sys.stdout
+    sys.stdout = ThreadOutput(stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+            results = [result for server_results in executor.map(check_server, servers)
+                       for result in server_results]
+    finally:
+        sys.stdout = stdout
+    print()
+    print('Leapp readiness report:')
+    for server, client_name, ready, failures in results:
+        if ready:
+            print(SUCCESS+' '+server.name+': '+client_name+' is ready to LEAPP')
+        elif ready is None:
+            print(FAIL+' '+server.name+': '+client_name+' is not registered')
+        else:
+            print(FAIL+' '+server.name+': '+client_name+' is not ready to LEAPP')
+            for failure in failures:
+                print('\t- '+failure)
+    for server in servers:
+        print()
+        print(server.name+' ('+server.url+')')
+        server.limiter.summary()
+    return results
+
+def failed_results(results):
+    # An unregistered host fails the run, except for a -c client looked up on
+    # every server, which only has to be registered to one of them
+    failed = [result for result in results if result[2] is False or
+              (result[2] is None and result[1] != args.client)]
+    client_results = [result for result in results if result[1] == args.client]
+    if client_results and all(result[2] is None for result in client_results):
+        failed.extend(client_results)
+    return failed
+
+'''
+Push the client checks to many hosts at once with a single remote execution
+job per Satellite. Every host runs this script in client mode with --json and
+the result lines are collected by polling the job's hosts in bulk.
+'''
+def rex_command():
+    # Ship this script inside the job so the hosts don't need a copy of it
+    with open(os.path.abspath(__file__), 'rb') as script_file:
+        script = base64.b64encode(script_file.read()).decode('UTF-8')
+    # mktemp creates a new private file rather than following an existing path
+    return ('path=$(mktemp) || exit 1\n'
+            'echo '+script+' | base64 -d > "$path"\n'
+            'python3 "$path" --json -v '+shlex.quote(args.version)+
+            (' --prewarm-cache '+shlex.quote(args.prewarm_cache) if args.prewarm_cache else '')+'\n'
+            'rc=$?\nrm -f "$path"\nexit $rc\n')
+
+def start_rex_job(server, search):
+    templates = response_json(server, api_call(server, '/api/job_templates',
+                                               params={'search': 'name="'+REX_JOB_TEMPLATE+'"'}))
+    if not templates.get('results'):
+        print(FAIL+" Job template \""+REX_JOB_TEMPLATE+"\" not found on "+server.url)
+        exit(1)
+    data = {
+        'job_invocation': {
+            'job_template_id': templates['results'][0]['id'],
+            'targeting_type': 'static_query',
+            'search_query': search,
+            'inputs': {'command': rex_command()},
+            'description_format': 'Leapp readiness check to RHEL '+args.version
+        }
+    }
+    response = api_call(server, '/api/job_invocations', 'POST', data=data)
+    if not response.ok:
+        print(FAIL+" Failed to start the remote execution job on "+server.url)
+        print('\t'+response.text)
+        exit(1)
+    job_id = response_json(server, response)['id']
+    print(SUCCESS+" Started remote execution job "+server.url+"/job_invocations/"+str(job_id)+
+          " for hosts matching: "+search)
+    return job_id
+
+def get_rex_hosts(server, job_id):
+    # Returns None when a page could not be read
+    hosts = []
+    page = 1
+    while True:
+        response = api_call(server, '/api/job_invocations/'+str(job_id)+'/hosts',
+                            params={'per_page': REX_HOSTS_PER_PAGE, 'page': page})
+        if not response.ok:
+            print(FAIL+" "+server.url+" answered HTTP "+str(response.status_code)+" to "+response.url)
+            return None
+        response = response.json()
+        hosts.extend(response['results'])
+        if len(response['results']) < REX_HOSTS_PER_PAGE or len(hosts) >= response.get('subtotal', 0):
+            return hosts
+        page += 1
+
+def poll_rex_job(server, job_id):
+    # Returns the job and its hosts, or None when the Satellite did not answer properly
+    try:
+        response = api_call(server, '/api/job_invocations/'+str(job_id))
+        if not response.ok:
+            print(FAIL+" "+server.url+" answered HTTP "+str(response.status_code)+" to "+response.url)
+            return None
+        job = response.json()
+        hosts = get_rex_hosts(server, job_id)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as error:
+        print(FAIL+" Polling remote execution job "+str(job_id)+" on "+server.url+" failed: "+str(error))
+        return None
+    if hosts is None:
+        return None
+    return job, hosts
+
+def parse_rex_output(output):
+    for line in output.splitlines():
+        if REX_RESULT_MARKER in line:
+            try:
+                return json.loads(line.split(REX_RESULT_MARKER, 1)[1])
+            except ValueError:
+                return None
+    return None
+
+def get_rex_host_result(server, job_id, host):
+    try:
+        response = api_call(server, '/api/job_invocations/'+str(job_id)+'/hosts/'+str(host['id'])+'/raw')
+    except requests.exceptions.RequestException:
+        return None
+    if not response.ok:
+        return None
+    return parse_rex_output(response.text)
+
+def print_rex_result(server, host, result):
+    if result is None:
+        print(FAIL+' '+server.name+': '+host['name']+' returned no result (job status: '+str(host.get('job_status'))+')')
+    elif result['ready']:
+        print(SUCCESS+' '+server.name+': '+host['name']+' is ready to LEAPP')
+        if result.get('prewarm') is False:
+            print('\t- pre-warming the target repositories\' metadata failed')
+    else:
+        print(FAIL+' '+server.name+': '+host['name']+' is not ready to LEAPP')
+        for failure in result['failures']:
+            print('\t- '+failure)
+
+def collect_rex_results(server, job_id):
+    # Print each host's verdict as soon as it finishes, until the whole job is done
+    results = {}
+    known_hosts = {}
+    errors = 0
+    while True:
+        poll = poll_rex_job(server, job_id)
+        if poll is None:
+            errors += 1
+            if errors >= REX_POLL_MAX_ERRORS:
+                print(FAIL+" Giving up on remote execution job "+str(job_id)+" on "+server.url+
+                      " after "+str(errors)+" failed polls")
+                break
+            time.sleep(REX_POLL_INTERVAL)
+            continue
+        errors = 0
+        job, hosts = poll
+        for host in hosts:
+            known_hosts[host['id']] = host
+        finished = [host for host in hosts
+                    if host['id'] not in results and str(host.get('job_status')).lower() not in REX_RUNNING_STATES]
+        if len(finished) > 0:
+            workers = min(len(finished), server.max_concurrency or DEFAULT_CLIENT_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                host_results = executor.map(lambda host: get_rex_host_result(server, job_id, host), finished)
+                for host, result in zip(finished, host_results):
+                    results[host['id']] = (host['name'], result)
+                    print_rex_result(server, host, result)
+        if str(job.get('status_label', '')).lower() not in REX_RUNNING_STATES:
+            break
+        time.sleep(REX_POLL_INTERVAL)
+    # Hosts that never finished still count, as hosts without a result
+    for host_id, host in known_hosts.items():
+        if host_id not in results:
+            results[host_id] = (host['name'], None)
+            print_rex_result(server, host, None)
+    return [(server, name, result['ready'] if result else None) for name, result in results.values()]
+
+def run_rex_check(server, search):
+    # Returns None when the job could not be started or followed
+    try:
+        check_satellite_connection(server)
+        job_id = start_rex_job(server, search)
+        return collect_rex_results(server, job_id)
+    except SystemExit:
+        return None
+    except Exception as error:
+        print(FAIL+" The remote execution check on "+server.name+" failed with the following error: ")
+        print(f"An error occurred: {error!r}")
+        return None
+
+def run_rex_checks(servers, search):
+    # Returns the per host results and the servers whose job failed
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        server_results = list(executor.map(lambda server: run_rex_check(server, search), servers))
+    results = [result for host_results in server_results if host_results for result in host_results]
+    failed_servers = [server for server, host_results in zip(servers, server_results) if host_results is None]
+    print()
+    print('Leapp readiness report:')
+    for server in failed_servers:
+        print(FAIL+' '+server.name+': the remote execution job failed')
+    print('\tReady: '+str(len([result for result in results if result[2]])))
+    print('\tNot ready: '+str(len([result for result in results if result[2] is False])))
+    print('\tNo result: '+str(len([result for result in results if result[2] is None])))
+    for server in servers:
+        print()
+        print(server.name+' ('+server.url+')')
+        server.limiter.summary()
+    return results, failed_servers
+
+def check_client_json():
+    # Run the client checks and always finish with a result line the Satellite can parse
+    output = io.StringIO()
+    ready = False
+    errors = []
+    try:
+        with contextlib.redirect_stdout(output):
+            try:
+                get_leapp_version()
+                check_client()
+                ready = True
+            except SystemExit:
+                pass
+            except Exception as error:
+                errors.append(repr(error))
+    finally:
+        print(output.getvalue(), end='')
+        failures = failure_lines(output.getvalue())+errors
+        if not ready and not failures:
+            failures.append('The client checks stopped without reporting a reason')
+        result = {
+            'hostname': socket.getfqdn(),
+            'leapp_version': args.version,
+            'ready': ready,
+            'prewarm': PREWARM_STATUS,
+            'failures': failures
+        }
+        print(REX_RESULT_MARKER+json.dumps(result))
+    if not ready:
+        exit(1)
+
+def local_satellite():
+    return SatelliteServer('satellite', get_hostname(), get_username(), get_password(),
+                           max_concurrency=args.max_concurrency, max_rps=args.max_rps, local=True)
 
 def main():
     usage()
-    if is_satellite('satellite-installer'):
+    if args.rex_search:
+        if not args.version:
+            print(FAIL+" A leapp version is required when running the checks through remote execution")
+            print("\tExample: \"satellite_leapp_check --rex-search 'os_major = 7' -v 8.10\"")
+            exit(1)
+        if args.config:
+            servers = read_config(args.config)
+        elif is_satellite('satellite-installer'):
+            servers = [local_satellite()]
+        else:
+            print(FAIL+" Remote execution checks must be run on a Satellite or with --config")
+            exit(1)
+        results, failed_servers = run_rex_checks(servers, args.rex_search)
+        if failed_servers or len(results) == 0 or not all(result[2] for result in results):
+            exit(1)
+    elif args.config:
+        servers = read_config(args.config)
+        if not args.version:
+            print(FAIL+" A leapp version is required when checking several Satellites")
+            print("\tExample: \"satellite_leapp_check --config satellites.ini -v 8.10\"")
+            exit(1)
+        results = check_servers(servers)
+        if len(results) == 0 or failed_results(results):
+            exit(1)
+    elif is_satellite('satellite-installer'):
         print('satellite-installer package detected on executing server')
         print('Calling the Satellite API for information on the specified client')
-        get_username()
-        get_password()
-        get_hostname()
-        parse_client()
+        server = local_satellite()
+        check_satellite_connection(server)
+        try:
+            if parse_client(server, args.client) is None:
+                exit(1)
+        finally:
+            print()
+            server.limiter.summary()
     else:
         print("No satellite package found, assuming this server is a client")
-        get_leapp_version()
-        check_client()
+        if args.json:
+            check_client_json()
+        else:
+            get_leapp_version()
+            check_client()
 
 
 
@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+
+import pytest
+import requests
+
+# The script parses its command line on import, keep pytest's arguments away from it
+sys.argv = ['satellite_leapp_check.py']
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import satellite_leapp_check as slc
+
+
+@pytest.fixture(autouse=True)
+def no_retry_sleep(monkeypatch):
+    monkeypatch.setattr(slc, 'API_RETRY_BACKOFF', 0)
+    monkeypatch.setattr(slc, 'API_RETRY_MAX_DELAY', 0)
+
+
+def make_response(status_code=200, body=None, url='', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.headers.update(headers or {})
+    if isinstance(body, (dict, list)):
+        response._content = json.dumps(body).encode('UTF-8')
+        response.headers['Content-Type'] = 'application/json'
+    else:
+        response._content = (body or '').encode('UTF-8')
+    return response
+
+
+class MockSatellite:
+    '''
+    Answers a SatelliteServer's requests from a table of routes instead of the
+    network. A route maps (method, path) to a response, a list of responses
+    served in turn (the last one repeats), or a callable taking the params.
+    '''
+    def __init__(self, server, routes=None):
+        self.server = server
+        self.routes = routes or {}
+        self.calls = []
+        server.session.request = self.request
+        server.session.get = lambda url, **kwargs: self.request('GET', url, **kwargs)
+
+    def request(self, method, url, params=None, json=None, **kwargs):
+        path = url[len(self.server.url):] or '/'
+        self.calls.append((method, path, params, json))
+        route = self.routes.get((method, path))
+        if route is None:
+            return make_response(404, {'error': {'message': 'not found'}}, url)
+        if isinstance(route, list):
+            route = route.pop(0) if len(route) > 1 else route[0]
+        if callable(route):
+            route = route(params)
+        status_code, body = route
+        return make_response(status_code, body, url)
+
+
+@pytest.fixture
+def mock_satellite():
+    def build(routes=None, name='mock', hostname='http://satellite.example.com'):
+        server = slc.SatelliteServer(name, hostname, 'admin', 'changeme', ca_cert=False)
+        return MockSatellite(server, routes)
+    return build
@@ -0,0 +1,193 @@
+import threading
+import time
+
+import pytest
+
+import satellite_leapp_check as slc
+
+
+def run(limiter, count, latency, status_code=200):
+    for _ in range(count):
+        limiter.acquire()
+        limiter.release(latency, status_code)
+
+
+def test_limit_grows_while_latency_is_stable():
+    limiter = slc.AdaptiveLimiter()
+    run(limiter, 100, 0.1)
+    assert limiter.limit == 7
+    assert [decision[0] for decision in limiter.decisions] == ['increase']*5
+
+
+def test_limit_respects_hard_cap():
+    limiter = slc.AdaptiveLimiter(max_limit=3)
+    run(limiter, 200, 0.1)
+    assert limiter.limit == 3
+    assert limiter.peak == 3
+
+
+def test_overload_response_halves_limit():
+    limiter = slc.AdaptiveLimiter()
+    run(limiter, 100, 0.1)
+    run(limiter, 1, 0.1, 503)
+    assert limiter.limit == 3.5
+    assert limiter.overloads == 1
+    assert limiter.decisions[-1] == ('decrease', 'HTTP 503', 7, 3)
+
+
+def test_concurrent_overloads_halve_the_limit_once():
+    limiter = slc.AdaptiveLimiter(initial=16)
+    tokens = [limiter.acquire() for _ in range(8)]
+    for token in tokens:
+        limiter.release(0.1, 503, token)
+    assert limiter.limit == 8
+    assert limiter.overloads == 8
+    assert [decision[0] for decision in limiter.decisions] == ['decrease']
+    # A request started after the decrease is a new congestion event
+    limiter.release(0.1, 503, limiter.acquire())
+    assert limiter.limit == 4
+
+
+def test_timeout_is_an_overload():
+    limiter = slc.AdaptiveLimiter(initial=8)
+    limiter.release(30, slc.REQUEST_TIMED_OUT, limiter.acquire())
+    assert limiter.limit == 4
+    assert limiter.decisions[-1][1] == 'timeout'
+
+
+def test_failed_requests_are_not_latency_samples():
+    limiter = slc.AdaptiveLimiter()
+    run(limiter, 100, 0.0, slc.REQUEST_FAILED)
+    assert limiter.limit == 2
+    assert len(limiter.latencies) == 0
+
+
+def test_limit_never_drops_below_one():
+    limiter = slc.AdaptiveLimiter()
+    run(limiter, 10, 0.1, 429)
+    assert limiter.limit == 1
+
+
+def test_latency_rise_halves_limit():
+    limiter = slc.AdaptiveLimiter()
+    run(limiter, 100, 0.1)
+    run(limiter, 20, 1.0)
+    assert limiter.limit == 3.5
+    assert limiter.decisions[-1][0] == 'decrease'
+
+
+def test_limit_recovers_after_latency_settles_at_a_new_level():
+    limiter = slc.AdaptiveLimiter()
+    run(limiter, 200, 0.1)
+    assert limiter.limit == 12
+    run(limiter, 2000, 0.2)
+    assert limiter.limit > 12
+    assert limiter.decisions[-1][0] == 'increase'
+
+
+def test_acquire_blocks_at_the_limit():
+    limiter = slc.AdaptiveLimiter(initial=1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def second():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release(0.1)
+    assert acquired.wait(1)
+    thread.join()
+
+
+def test_max_rps_spaces_request_starts():
+    limiter = slc.AdaptiveLimiter(initial=10, max_rps=50)
+    start = time.monotonic()
+    run(limiter, 6, 0.0)
+    assert time.monotonic()-start >= 0.09
+
+
+@pytest.mark.parametrize('option,value', [
+    ('--max-concurrency', '0'),
+    ('--max-concurrency', '-1'),
+    ('--max-rps', '0'),
+    ('--max-rps', '-2'),
+])
+def test_limits_below_one_are_rejected(option, value):
+    with pytest.raises(SystemExit):
+        slc.parser.parse_args([option, value])
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def fake_server(monkeypatch, status_codes):
+    server = slc.SatelliteServer('mock', 'http://satellite.example.com', 'admin', 'changeme', ca_cert=False)
+    calls = []
+
+    def request(method, url, params=None, json=None, timeout=None):
+        calls.append((method, url, timeout))
+        status_code = status_codes[len(calls)-1]
+        if status_code == 'timeout':
+            raise slc.requests.exceptions.ReadTimeout('timed out')
+        return FakeResponse(status_code)
+
+    monkeypatch.setattr(server.session, 'request', request)
+    return server, calls
+
+
+def test_api_call_retries_overload_responses(monkeypatch):
+    server, calls = fake_server(monkeypatch, [503, 429, 200])
+    assert slc.api_call(server, '/api/status').status_code == 200
+    assert len(calls) == 3
+    assert server.limiter.overloads == 2
+
+
+def test_api_call_uses_a_timeout(monkeypatch):
+    server, calls = fake_server(monkeypatch, [200])
+    slc.api_call(server, '/api/status')
+    assert calls[0][2] == slc.API_TIMEOUT
+
+
+def test_api_call_retries_timeouts(monkeypatch):
+    server, calls = fake_server(monkeypatch, ['timeout', 200])
+    assert slc.api_call(server, '/api/status').status_code == 200
+    assert server.limiter.overloads == 1
+    assert server.limiter.in_flight == 0
+
+
+def test_api_call_raises_after_repeated_timeouts(monkeypatch):
+    server, calls = fake_server(monkeypatch, ['timeout']*(slc.API_RETRIES+1))
+    with pytest.raises(slc.requests.exceptions.Timeout):
+        slc.api_call(server, '/api/status')
+    assert server.limiter.in_flight == 0
+
+
+def test_api_call_does_not_retry_post_timeouts(monkeypatch):
+    server, calls = fake_server(monkeypatch, ['timeout', 200])
+    with pytest.raises(slc.requests.exceptions.Timeout):
+        slc.api_call(server, '/api/job_invocations', 'POST', data={})
+    assert len(calls) == 1
+
+
+def test_api_call_gives_up_after_retries(monkeypatch):
+    server, calls = fake_server(monkeypatch, [503]*(slc.API_RETRIES+1))
+    assert slc.api_call(server, '/api/status').status_code == 503
+    assert len(calls) == slc.API_RETRIES+1
+
+
+def test_api_call_does_not_retry_post_on_502(monkeypatch):
+    server, calls = fake_server(monkeypatch, [502, 200])
+    assert slc.api_call(server, '/api/job_invocations', 'POST', data={}).status_code == 502
+    assert len(calls) == 1
+
+
+def test_retry_delay_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(slc, 'API_RETRY_MAX_DELAY', 30)
+    assert slc.retry_delay(FakeResponse(429, {'Retry-After': '5'}), 0) == 5
+    assert slc.retry_delay(FakeResponse(429, {'Retry-After': '600'}), 0) == 30
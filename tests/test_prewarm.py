@@ -0,0 +1,323 @@
+import hashlib
+import os
+
+import subprocess
+
+import pytest
+
+import satellite_leapp_check as slc
+
+CONTENT = 'https://satellite.example.com/pulp/content/ACME/Library/content/'
+BASE_URL = CONTENT+'dist/rhel8/8.10/x86_64/baseos/os/'
+REDHAT_REPO = '''[rhel-7-server-rpms]
+name = Red Hat Enterprise Linux 7 Server (RPMs)
+baseurl = '''+CONTENT+'''dist/rhel/server/7/$releasever/$basearch/os
+sslclientcert = /etc/pki/entitlement/1.pem
+sslclientkey = /etc/pki/entitlement/1-key.pem
+sslcacert = /etc/rhsm/ca/katello-server-ca.pem
+
+[rhel-8-for-x86_64-baseos-rpms]
+name = Red Hat Enterprise Linux 8 for x86_64 - BaseOS (RPMs)
+baseurl = '''+CONTENT+'''dist/rhel8/$releasever/$basearch/baseos/os
+'''
+PRIMARY = b'<metadata>primary</metadata>'*100
+FILELISTS = b'<filelists/>'*100
+RH_REPO_CONF = {'sslclientcert': 'cert.pem', 'sslclientkey': 'key.pem', 'sslcacert': 'ca.pem'}
+
+
+def entry(data_type, content, checksum=None):
+    return {
+        'type': data_type,
+        'href': 'repodata/'+data_type+'.xml.gz',
+        'checksum_type': 'sha256',
+        'checksum': checksum or hashlib.sha256(content).hexdigest(),
+    }
+
+
+def repomd(*entries):
+    data = ''.join('<data type="%s"><checksum type="%s">%s</checksum><location href="%s"/></data>' % (
+        e['type'], e['checksum_type'], e['checksum'], e['href']) for e in entries)
+    return ('<?xml version="1.0"?><repomd xmlns="http://linux.duke.edu/metadata/repo">'
+            '<data type="other"><checksum type="sha256">x</checksum><location href="repodata/other.xml.gz"/></data>'
+            +data+'</repomd>').encode('UTF-8')
+
+
+class FakeDownload:
+    def __init__(self, status_code, content, url=''):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise slc.requests.exceptions.HTTPError(str(self.status_code))
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start+chunk_size]
+
+
+class FakeRepoServer:
+    '''Serves metadata files by URL and honours Range headers unless told not to'''
+    def __init__(self, files, ranges=True):
+        self.files = files
+        self.ranges = ranges
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append((url, headers))
+        if url not in self.files:
+            return FakeDownload(404, b'')
+        content = self.files[url]
+        if 'Range' in headers and self.ranges:
+            start = int(headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(content):
+                return FakeDownload(416, b'')
+            return FakeDownload(206, content[start:], url)
+        return FakeDownload(200, content, url)
+
+
+@pytest.fixture
+def repo_server(monkeypatch):
+    def build(files, ranges=True):
+        server = FakeRepoServer(files, ranges)
+        monkeypatch.setattr(slc.SESSION, 'get', server.get)
+        return server
+    return build
+
+
+@pytest.fixture(autouse=True)
+def redhat_repo(tmp_path, monkeypatch):
+    path = tmp_path/'redhat.repo'
+    path.write_text(REDHAT_REPO)
+    monkeypatch.setattr(slc, 'REDHAT_REPO', str(path))
+    return path
+
+
+def test_dnf_cache_dir_follows_dnf_naming(tmp_path):
+    digest = hashlib.sha256(BASE_URL.encode('UTF-8')).hexdigest()[:16]
+    assert slc.dnf_cache_dir(str(tmp_path), 'rhel-8-for-x86_64-baseos-rpms', BASE_URL) == \
+        os.path.join(str(tmp_path), 'rhel-8-for-x86_64-baseos-rpms-'+digest)
+
+
+def test_target_baseurl_comes_from_redhat_repo():
+    assert slc.target_repo_baseurl('rhel-8-for-x86_64-baseos-rpms', '8.10', BASE_URL+'repodata/repomd.xml') == \
+        CONTENT+'dist/rhel8/8.10/x86_64/baseos/os'
+
+
+def test_target_baseurl_falls_back_to_the_repomd_url():
+    repomd_url = CONTENT+'dist/rhel8/8.10/x86_64/appstream/os/repodata/repomd.xml'
+    assert slc.target_repo_baseurl('rhel-8-for-x86_64-appstream-rpms', '8.10', repomd_url) == \
+        CONTENT+'dist/rhel8/8.10/x86_64/appstream/os'
+
+
+def test_parse_repomd_keeps_prewarmed_types():
+    assert [e['type'] for e in slc.parse_repomd(repomd(entry('primary', PRIMARY)))] == ['primary']
+
+
+def test_download(tmp_path, repo_server):
+    server = repo_server({BASE_URL+'repodata/primary.xml.gz': PRIMARY})
+    assert slc.download_metadata(RH_REPO_CONF, BASE_URL, str(tmp_path), entry('primary', PRIMARY)) == 'downloaded'
+    assert (tmp_path/'repodata'/'primary.xml.gz').read_bytes() == PRIMARY
+    assert server.requests[0][1] == {}
+
+
+def test_cached_file_is_skipped(tmp_path, repo_server):
+    server = repo_server({})
+    (tmp_path/'repodata').mkdir()
+    (tmp_path/'repodata'/'primary.xml.gz').write_bytes(PRIMARY)
+    assert slc.download_metadata(RH_REPO_CONF, BASE_URL, str(tmp_path), entry('primary', PRIMARY)) == 'cached'
+    assert server.requests == []
+
+
+def test_partial_download_is_resumed(tmp_path, repo_server):
+    server = repo_server({BASE_URL+'repodata/primary.xml.gz': PRIMARY})
+    (tmp_path/'repodata').mkdir()
+    (tmp_path/'repodata'/'primary.xml.gz.part').write_bytes(PRIMARY[:1000])
+    assert slc.download_metadata(RH_REPO_CONF, BASE_URL, str(tmp_path), entry('primary', PRIMARY)) == 'resumed'
+    assert server.requests[0][1] == {'Range': 'bytes=1000-'}
+    assert (tmp_path/'repodata'/'primary.xml.gz').read_bytes() == PRIMARY
+    assert not (tmp_path/'repodata'/'primary.xml.gz.part').exists()
+
+
+def test_complete_partial_download_is_kept(tmp_path, repo_server):
+    repo_server({BASE_URL+'repodata/primary.xml.gz': PRIMARY})
+    (tmp_path/'repodata').mkdir()
+    (tmp_path/'repodata'/'primary.xml.gz.part').write_bytes(PRIMARY)
+    assert slc.download_metadata(RH_REPO_CONF, BASE_URL, str(tmp_path), entry('primary', PRIMARY)) == 'resumed'
+    assert (tmp_path/'repodata'/'primary.xml.gz').read_bytes() == PRIMARY
+
+
+def test_server_ignoring_range_restarts_download(tmp_path, repo_server):
+    repo_server({BASE_URL+'repodata/primary.xml.gz': PRIMARY}, ranges=False)
+    (tmp_path/'repodata').mkdir()
+    (tmp_path/'repodata'/'primary.xml.gz.part').write_bytes(PRIMARY[:1000])
+    slc.download_metadata(RH_REPO_CONF, BASE_URL, str(tmp_path), entry('primary', PRIMARY))
+    assert (tmp_path/'repodata'/'primary.xml.gz').read_bytes() == PRIMARY
+
+
+def test_checksum_mismatch_is_discarded(tmp_path, repo_server):
+    repo_server({BASE_URL+'repodata/primary.xml.gz': PRIMARY})
+    with pytest.raises(ValueError):
+        slc.download_metadata(RH_REPO_CONF, BASE_URL, str(tmp_path), entry('primary', PRIMARY, 'bad'))
+    assert os.listdir(str(tmp_path/'repodata')) == []
+
+
+class FakeRepomd:
+    def __init__(self, content):
+        self.url = BASE_URL+'repodata/repomd.xml'
+        self.content = content
+
+
+def baseos_dir(tmp_path):
+    return slc.dnf_cache_dir(str(tmp_path), 'rhel-8-for-x86_64-baseos-rpms', CONTENT+'dist/rhel8/8.10/x86_64/baseos/os')
+
+
+def test_prewarm_writes_dnf_cache_layout(tmp_path, repo_server, monkeypatch):
+    monkeypatch.setattr(slc, 'repo_file_check', lambda label: RH_REPO_CONF)
+    repo_server({BASE_URL+'repodata/primary.xml.gz': PRIMARY, BASE_URL+'repodata/filelists.xml.gz': FILELISTS})
+    content = repomd(entry('primary', PRIMARY), entry('filelists', FILELISTS))
+    assert slc.prewarm_leapp_repos({'baseos': FakeRepomd(content)}, str(tmp_path), '8.10') is True
+    repodata = os.path.join(baseos_dir(tmp_path), 'repodata')
+    assert sorted(os.listdir(repodata)) == ['filelists.xml.gz', 'primary.xml.gz', 'repomd.xml']
+    with open(os.path.join(repodata, 'repomd.xml'), 'rb') as repomd_file:
+        assert repomd_file.read() == content
+
+
+def test_failed_prewarm_does_not_write_repomd(tmp_path, repo_server, monkeypatch):
+    monkeypatch.setattr(slc, 'repo_file_check', lambda label: RH_REPO_CONF)
+    repo_server({BASE_URL+'repodata/primary.xml.gz': PRIMARY})
+    content = repomd(entry('primary', PRIMARY), entry('filelists', FILELISTS))
+    assert slc.prewarm_leapp_repos({'baseos': FakeRepomd(content)}, str(tmp_path), '8.10') is False
+    assert not os.path.exists(os.path.join(baseos_dir(tmp_path), 'repodata', 'repomd.xml'))
+
+
+def test_json_result_reports_prewarm_status(monkeypatch, capsys):
+    def check_client():
+        monkeypatch.setattr(slc, 'PREWARM_STATUS', False)
+
+    monkeypatch.setattr(slc.args, 'version', '8.10')
+    monkeypatch.setattr(slc, 'check_client', check_client)
+    slc.check_client_json()
+    result = slc.parse_rex_output(capsys.readouterr().out)
+    assert result['ready'] is True
+    assert result['prewarm'] is False
+
+
+class FakePopen:
+    def __init__(self, cmd, **kwargs):
+        self.cmd = cmd
+        self.returncode = 0
+
+    def communicate(self):
+        if self.cmd[:3] == ['subscription-manager', 'release', '--list']:
+            return b'7.9\n8.10\n', b''
+        return b'', b''
+
+
+@pytest.fixture
+def fake_client(tmp_path, monkeypatch, repo_server):
+    # A registered RHEL 7 client whose subscription-manager commands all succeed
+    commands = []
+
+    def run(cmd, **kwargs):
+        commands.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, b'', b'')
+
+    def call(cmd, **kwargs):
+        assert 'shell' not in kwargs
+        commands.append(cmd)
+        return 0
+
+    monkeypatch.setattr(slc.subprocess, 'run', run)
+    monkeypatch.setattr(slc.subprocess, 'call', call)
+    monkeypatch.setattr(slc.subprocess, 'Popen', FakePopen)
+    monkeypatch.setattr(slc, 'resolve_rhsm_hostname', lambda: True)
+    monkeypatch.setattr(slc, 'get_os_major', lambda: '7')
+    monkeypatch.setattr(slc, 'PREWARM_STATUS', None)
+    monkeypatch.setattr(slc.args, 'version', '8.10')
+    monkeypatch.setattr(slc.args, 'prewarm_cache', str(tmp_path/'cache'))
+    content = repomd(entry('primary', PRIMARY))
+    server = repo_server({
+        BASE_URL+'repodata/repomd.xml': content,
+        BASE_URL+'repodata/primary.xml.gz': PRIMARY,
+        CONTENT+'dist/rhel8/8.10/x86_64/appstream/os/repodata/repomd.xml': repomd(),
+    })
+    return commands, server
+
+
+def test_sub_man_refresh_waits_for_the_command(monkeypatch):
+    monkeypatch.setattr(slc.subprocess, 'run',
+                        lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 0, b'', b''))
+    assert slc.sub_man_refresh() is True
+    monkeypatch.setattr(slc.subprocess, 'run',
+                        lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 1, b'', b'not registered'))
+    assert slc.sub_man_refresh() is False
+
+
+def test_check_client_prewarms_the_cache(tmp_path, fake_client, capsys):
+    commands, server = fake_client
+    slc.check_client()
+    assert ['subscription-manager', 'refresh'] in commands
+    assert slc.PREWARM_STATUS is True
+    cached = os.path.join(baseos_dir(tmp_path/'cache'), 'repodata')
+    assert sorted(os.listdir(cached)) == ['primary.xml.gz', 'repomd.xml']
+    assert 'Your client is ready to Leapp!' in capsys.readouterr().out
+
+
+def test_check_client_reports_failed_prewarm(fake_client, capsys):
+    commands, server = fake_client
+    del server.files[BASE_URL+'repodata/primary.xml.gz']
+    slc.check_client()
+    assert slc.PREWARM_STATUS is False
+    output = capsys.readouterr().out
+    assert 'Your client is ready to Leapp!' in output
+    assert "Pre-warming the target repositories' metadata failed" in output
+
+
+def json_result(capsys, exit_code=None):
+    if exit_code is None:
+        slc.check_client_json()
+    else:
+        with pytest.raises(SystemExit):
+            slc.check_client_json()
+    output = capsys.readouterr().out
+    return output, slc.parse_rex_output(output)
+
+
+def test_json_mode_runs_the_real_client_checks(fake_client, capsys):
+    output, result = json_result(capsys)
+    assert 'Your client is ready to Leapp!' in output
+    assert result['ready'] is True
+    assert result['prewarm'] is True
+    assert result['failures'] == []
+
+
+def test_json_mode_reports_why_the_client_is_not_ready(fake_client, capsys, monkeypatch):
+    monkeypatch.setattr(slc.subprocess, 'run',
+                        lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 1, b'', b'This system is not registered'))
+    output, result = json_result(capsys, 1)
+    assert 'This system is not registered' in output
+    assert result['ready'] is False
+    assert result['failures'] == ["The command 'subscription-manager refresh' returned an error!"]
+
+
+def test_json_mode_reports_unexpected_errors(fake_client, capsys, redhat_repo):
+    redhat_repo.write_text('[rhel-8-for-x86_64-baseos-rpms]\nbaseurl = '+BASE_URL+'\n')
+    output, result = json_result(capsys, 1)
+    assert result['ready'] is False
+    assert result['failures'] == ["KeyError('rhel-7-server-rpms')"]
+
+
+def test_json_mode_explains_silent_exits(capsys, monkeypatch):
+    monkeypatch.setattr(slc.args, 'version', '8.10')
+    monkeypatch.setattr(slc, 'check_client', lambda: exit(1))
+    output, result = json_result(capsys, 1)
+    assert result['failures'] == ['The client checks stopped without reporting a reason']
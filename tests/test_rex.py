@@ -0,0 +1,156 @@
+import base64
+import json
+
+import pytest
+
+import satellite_leapp_check as slc
+
+JOB = '/api/job_invocations/42'
+JOB_HOSTS = JOB+'/hosts'
+
+
+@pytest.fixture(autouse=True)
+def rex_options(monkeypatch):
+    monkeypatch.setattr(slc, 'REX_POLL_INTERVAL', 0)
+    monkeypatch.setattr(slc.args, 'version', '8.10')
+    monkeypatch.setattr(slc.args, 'prewarm_cache', None)
+
+
+def result_line(ready, failures=()):
+    return 'some output\n'+slc.REX_RESULT_MARKER+json.dumps(
+        {'hostname': 'h', 'leapp_version': '8.10', 'ready': ready, 'failures': list(failures)})+'\n'
+
+
+def hosts_page(*hosts):
+    return (200, {'subtotal': len(hosts), 'results': [
+        {'id': host_id, 'name': 'h'+str(host_id), 'job_status': status} for host_id, status in hosts]})
+
+
+def job(status):
+    return (200, {'id': 42, 'status_label': status})
+
+
+def verdicts(results):
+    return sorted((name, ready) for server, name, ready in results)
+
+
+def test_parse_rex_output():
+    assert slc.parse_rex_output(result_line(False, ['x'])) == {
+        'hostname': 'h', 'leapp_version': '8.10', 'ready': False, 'failures': ['x']}
+    assert slc.parse_rex_output('no marker here') is None
+    assert slc.parse_rex_output(slc.REX_RESULT_MARKER+'{truncated') is None
+
+
+def test_rex_command_uses_a_private_temporary_file(monkeypatch):
+    monkeypatch.setattr(slc.args, 'prewarm_cache', '/var/cache/leapp metadata')
+    command = slc.rex_command()
+    assert command.startswith('path=$(mktemp) || exit 1\n')
+    assert '/tmp/satellite_leapp_check.py' not in command
+    assert '--json -v 8.10' in command
+    assert "--prewarm-cache '/var/cache/leapp metadata'" in command
+    script = base64.b64decode(command.split('\n')[1].split()[1])
+    assert script.startswith(b'#! /usr/bin/python3')
+
+
+def test_start_rex_job(mock_satellite):
+    satellite = mock_satellite({
+        ('GET', '/api/job_templates'): (200, {'results': [{'id': 7}]}),
+        ('POST', '/api/job_invocations'): (201, {'id': 42}),
+    })
+    assert slc.start_rex_job(satellite.server, 'os_major = 7') == 42
+    payload = satellite.calls[-1][3]['job_invocation']
+    assert payload['job_template_id'] == 7
+    assert payload['search_query'] == 'os_major = 7'
+    assert payload['inputs']['command'].startswith('path=$(mktemp)')
+
+
+def test_start_rex_job_without_template(mock_satellite):
+    satellite = mock_satellite({('GET', '/api/job_templates'): (200, {'results': []})})
+    with pytest.raises(SystemExit):
+        slc.start_rex_job(satellite.server, 'os_major = 7')
+
+
+def test_results_are_collected_as_hosts_finish(mock_satellite):
+    satellite = mock_satellite({
+        ('GET', JOB): [job('running'), job('succeeded')],
+        ('GET', JOB_HOSTS): [hosts_page((1, 'success'), (2, 'running')),
+                             hosts_page((1, 'success'), (2, 'error'))],
+        ('GET', JOB_HOSTS+'/1/raw'): (200, result_line(True)),
+        ('GET', JOB_HOSTS+'/2/raw'): (200, result_line(False, ['No repos'])),
+    })
+    results = slc.collect_rex_results(satellite.server, 42)
+    assert verdicts(results) == [('h1', True), ('h2', False)]
+    raw_calls = [call[1] for call in satellite.calls if call[1].endswith('/raw')]
+    assert raw_calls == [JOB_HOSTS+'/1/raw', JOB_HOSTS+'/2/raw']
+
+
+def test_hosts_are_read_page_by_page(mock_satellite, monkeypatch):
+    monkeypatch.setattr(slc, 'REX_HOSTS_PER_PAGE', 2)
+    all_hosts = [{'id': i, 'name': 'h'+str(i), 'job_status': 'success'} for i in range(1, 6)]
+
+    def page(params):
+        start = (params['page']-1)*params['per_page']
+        return (200, {'subtotal': 5, 'results': all_hosts[start:start+params['per_page']]})
+
+    routes = {('GET', JOB): job('succeeded'), ('GET', JOB_HOSTS): page}
+    for i in range(1, 6):
+        routes[('GET', JOB_HOSTS+'/'+str(i)+'/raw')] = (200, result_line(True))
+    satellite = mock_satellite(routes)
+    assert len(slc.get_rex_hosts(satellite.server, 42)) == 5
+    assert [call[2]['page'] for call in satellite.calls] == [1, 2, 3]
+    assert len(slc.collect_rex_results(satellite.server, 42)) == 5
+
+
+def test_missing_result_line_is_no_result(mock_satellite):
+    satellite = mock_satellite({
+        ('GET', JOB): job('failed'),
+        ('GET', JOB_HOSTS): hosts_page((1, 'error'), (2, 'error')),
+        ('GET', JOB_HOSTS+'/1/raw'): (200, 'python3: command not found\n'),
+        ('GET', JOB_HOSTS+'/2/raw'): (500, 'oops'),
+    })
+    assert verdicts(slc.collect_rex_results(satellite.server, 42)) == [('h1', None), ('h2', None)]
+
+
+def test_failed_job_poll_is_retried_and_unfinished_hosts_are_reported(mock_satellite):
+    overloaded = [(503, {'error': 'busy'})]*(slc.API_RETRIES+1)
+    satellite = mock_satellite({
+        ('GET', JOB): overloaded+[job('running'), job('succeeded')],
+        ('GET', JOB_HOSTS): hosts_page((1, 'success'), (2, 'running'), (3, 'N/A')),
+        ('GET', JOB_HOSTS+'/1/raw'): (200, result_line(True)),
+    })
+    results = slc.collect_rex_results(satellite.server, 42)
+    assert verdicts(results) == [('h1', True), ('h2', None), ('h3', None)]
+
+
+def test_polling_gives_up_after_repeated_errors(mock_satellite, monkeypatch):
+    monkeypatch.setattr(slc, 'API_RETRIES', 0)
+    satellite = mock_satellite({
+        ('GET', JOB): [job('running')]+[(401, {'error': 'denied'})],
+        ('GET', JOB_HOSTS): hosts_page((1, 'running'), (2, 'pending')),
+    })
+    results = slc.collect_rex_results(satellite.server, 42)
+    assert verdicts(results) == [('h1', None), ('h2', None)]
+    job_polls = [call for call in satellite.calls if call[1] == JOB]
+    assert len(job_polls) == 1+slc.REX_POLL_MAX_ERRORS
+
+
+def test_failed_server_fails_the_run(mock_satellite):
+    good = mock_satellite({
+        ('GET', '/'): (200, ''),
+        ('GET', '/api/job_templates'): (200, {'results': [{'id': 7}]}),
+        ('POST', '/api/job_invocations'): (201, {'id': 42}),
+        ('GET', JOB): job('succeeded'),
+        ('GET', JOB_HOSTS): hosts_page((1, 'success')),
+        ('GET', JOB_HOSTS+'/1/raw'): (200, result_line(True)),
+    }, name='good')
+    bad = mock_satellite({('GET', '/'): (200, ''), ('GET', '/api/job_templates'): (200, 'not json')},
+                         name='bad', hostname='http://bad.example.com')
+    results, failed_servers = slc.run_rex_checks([good.server, bad.server], 'os_major = 7')
+    assert verdicts(results) == [('h1', True)]
+    assert failed_servers == [bad.server]
+
+
+def test_unexpected_errors_fail_only_that_server(mock_satellite, monkeypatch):
+    satellite = mock_satellite({('GET', '/'): (200, '')})
+    monkeypatch.setattr(slc, 'start_rex_job', lambda server, search: {}['missing'])
+    assert slc.run_rex_check(satellite.server, 'os_major = 7') is None
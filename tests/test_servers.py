@@ -0,0 +1,244 @@
+import os
+import stat
+
+import pytest
+
+import satellite_leapp_check as slc
+
+CV_VERSION = '/katello/api/content_view_versions/5'
+ORG_REPOS = slc.org_repos_endpoint(1)
+LEAPP_REPOS = [
+    "Red Hat Enterprise Linux 7 Server RPMs x86_64 7Server",
+    "Red Hat Enterprise Linux 7 Server - Extras RPMs x86_64",
+    "Red Hat Enterprise Linux 8 for x86_64 - AppStream RPMs 8.10",
+    "Red Hat Enterprise Linux 8 for x86_64 - BaseOS RPMs 8.10",
+]
+
+
+def host(name):
+    return {
+        'name': name,
+        'architecture_name': 'x86_64',
+        'organization_id': 1,
+        'facts': {'distribution::version': '7.9'},
+        'content_facet_attributes': {
+            'content_view_name': 'Default Organization View',
+            'content_view_version_id': 5,
+            'lifecycle_environment_name': 'Library',
+        },
+    }
+
+
+def satellite_routes(*clients):
+    routes = {
+        ('GET', '/'): (200, ''),
+        ('GET', ORG_REPOS): (200, {'results': [{'name': repo} for repo in LEAPP_REPOS]}),
+        ('GET', CV_VERSION): (200, {
+            'content_view_id': 2,
+            'content_view': {'name': 'Default Organization View'},
+            'repositories': [{'id': i, 'name': repo} for i, repo in enumerate(LEAPP_REPOS)],
+        }),
+    }
+    for i in range(len(LEAPP_REPOS)):
+        routes[('GET', '/katello/api/repositories/'+str(i))] = (200, {'content_counts': {'rpm': 10}})
+    for client in clients:
+        routes[('GET', '/api/hosts/'+client)] = (200, host(client))
+    return routes
+
+
+@pytest.fixture(autouse=True)
+def leapp_version(monkeypatch):
+    monkeypatch.setattr(slc.args, 'version', '8.10')
+    monkeypatch.setattr(slc.args, 'client', None)
+    monkeypatch.setattr(slc, 'USERNAME', None)
+    monkeypatch.setattr(slc, 'PASSWORD', None)
+
+
+def test_ready_client(mock_satellite):
+    satellite = mock_satellite(satellite_routes('client1'))
+    assert slc.parse_client(satellite.server, 'client1') is True
+
+
+def test_org_data_is_fetched_once_per_server(mock_satellite):
+    satellite = mock_satellite(satellite_routes('client1', 'client2', 'client3'))
+    satellite.server.clients = ['client1', 'client2', 'client3']
+    results = slc.check_servers([satellite.server])
+    assert [result[2] for result in results] == [True, True, True]
+    paths = [call[1] for call in satellite.calls]
+    assert paths.count(ORG_REPOS) == 1
+    assert paths.count(CV_VERSION) == 1
+
+
+def test_failed_responses_are_not_cached(mock_satellite):
+    routes = satellite_routes('client1')
+    routes[('GET', ORG_REPOS)] = [(401, {'error': 'denied'}), routes[('GET', ORG_REPOS)]]
+    satellite = mock_satellite(routes)
+    with pytest.raises(SystemExit):
+        satellite.server.get_cached_json(ORG_REPOS)
+    assert satellite.server.get_cached_json(ORG_REPOS)['results']
+
+
+def test_overload_responses_are_retried_before_caching(mock_satellite):
+    routes = satellite_routes('client1')
+    routes[('GET', ORG_REPOS)] = [(503, '<html>busy</html>'), routes[('GET', ORG_REPOS)]]
+    satellite = mock_satellite(routes)
+    assert satellite.server.get_cached_json(ORG_REPOS)['results']
+
+
+def test_non_json_response_fails_the_host(mock_satellite):
+    routes = satellite_routes('client1')
+    routes[('GET', ORG_REPOS)] = (200, '<html>maintenance</html>')
+    satellite = mock_satellite(routes)
+    assert slc.check_host(satellite.server, 'client1') is False
+
+
+def test_server_with_bad_credentials_does_not_stop_the_run(mock_satellite):
+    good = mock_satellite(satellite_routes('client1'), name='good')
+    good.server.clients = ['client1']
+    bad_routes = {('GET', '/'): (200, ''), ('GET', '/api/hosts/client2'): (401, {'error': 'denied'})}
+    bad = mock_satellite(bad_routes, name='bad', hostname='http://bad.example.com')
+    bad.server.clients = ['client2']
+    results = slc.check_servers([good.server, bad.server])
+    assert [(result[0].name, result[1], result[2]) for result in results] == [
+        ('good', 'client1', True), ('bad', 'client2', False)]
+    assert '401' in results[1][3][0]
+
+
+def test_each_host_output_is_printed_as_one_block(mock_satellite, capsys):
+    routes = satellite_routes('client1', 'client2')
+    routes[('GET', '/katello/api/repositories/0')] = (200, {'content_counts': {'rpm': 0}})
+    satellite = mock_satellite(routes)
+    satellite.server.clients = ['client1', 'client2']
+    results = slc.check_servers([satellite.server])
+    output = capsys.readouterr().out
+    blocks = output.split('\n=== ')[1:]
+    assert [block.split('\n')[0] for block in sorted(blocks)] == ['client1 on mock ===', 'client2 on mock ===']
+    for block in blocks:
+        client_name = block.split()[0]
+        assert 'Searching for host '+client_name in block
+        assert 'The following repos were found to have 0 RPMs' in block
+    assert results[0][3] == ['The following repos were found to have 0 RPMs']
+    report = output[output.index('Leapp readiness report:'):]
+    assert '- The following repos were found to have 0 RPMs' in report
+
+
+def test_limiter_is_capped_at_the_pool_size(mock_satellite):
+    server = mock_satellite().server
+    assert server.limiter.max_limit == slc.DEFAULT_POOL_SIZE
+    assert server.session.get_adapter('https://x')._pool_maxsize == slc.DEFAULT_POOL_SIZE
+    capped = slc.SatelliteServer('capped', 'sat.example.com', 'admin', 'changeme', max_concurrency=4)
+    assert capped.limiter.max_limit == 4
+    assert capped.session.get_adapter('https://x')._pool_maxsize == 4
+
+
+def test_unexpected_errors_fail_only_that_host(mock_satellite, monkeypatch):
+    satellite = mock_satellite(satellite_routes('client1'))
+    monkeypatch.setattr(slc, 'get_client_lce', lambda client: client['missing'])
+    assert slc.check_host(satellite.server, 'client1') is False
+
+
+def test_unreachable_server_fails_its_clients(mock_satellite):
+    satellite = mock_satellite({})
+
+    def missing_ca_bundle(url, **kwargs):
+        raise OSError('Could not find a suitable TLS CA certificate bundle')
+
+    satellite.server.session.get = missing_ca_bundle
+    satellite.server.clients = ['client1']
+    assert [result[2] for result in slc.check_servers([satellite.server])] == [False]
+
+
+def test_unregistered_hosts_fail_the_run(mock_satellite):
+    server = mock_satellite().server
+    assert slc.failed_results([(server, 'client1', True), (server, 'client2', None)])
+    assert not slc.failed_results([(server, 'client1', True)])
+
+
+def test_client_option_only_has_to_be_registered_once(mock_satellite, monkeypatch):
+    monkeypatch.setattr(slc.args, 'client', 'client1')
+    server = mock_satellite().server
+    assert not slc.failed_results([(server, 'client1', True), (server, 'client1', None)])
+    assert slc.failed_results([(server, 'client1', None), (server, 'client1', None)])
+
+
+def write_config(tmp_path, body):
+    path = tmp_path/'satellites.ini'
+    path.write_text(body)
+    return str(path)
+
+
+CREDENTIALS = 'username = admin\npassword = changeme\n'
+
+
+def test_config_ca_cert_defaults_to_system_bundle(tmp_path):
+    servers = slc.read_config(write_config(tmp_path, '[sat]\nhostname = sat.example.com\n'+CREDENTIALS))
+    assert servers[0].session.verify is True
+
+
+def test_missing_credentials_are_prompted_for_once(tmp_path, monkeypatch):
+    prompts = []
+    monkeypatch.setattr(slc.args, 'username', None)
+    monkeypatch.setattr(slc.args, 'password', None)
+    monkeypatch.setattr('builtins.input', lambda prompt: prompts.append(prompt) or 'admin')
+    monkeypatch.setattr(slc.getpass, 'getpass', lambda prompt: prompts.append(prompt) or 'changeme')
+    servers = slc.read_config(write_config(
+        tmp_path, '[sat1]\nhostname = sat1.example.com\n[sat2]\nhostname = sat2.example.com\n'))
+    assert [server.session.auth for server in servers] == [('admin', 'changeme')]*2
+    assert len(prompts) == 2
+
+
+def test_empty_credentials_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(slc.args, 'username', None)
+    monkeypatch.setattr(slc.args, 'password', None)
+    monkeypatch.setattr('builtins.input', lambda prompt: '')
+    monkeypatch.setattr(slc.getpass, 'getpass', lambda prompt: '')
+    with pytest.raises(SystemExit):
+        slc.read_config(write_config(tmp_path, '[sat]\nhostname = sat.example.com\n'))
+
+
+def test_config_ca_cert_must_exist(tmp_path):
+    path = write_config(tmp_path, '[sat]\nhostname = sat.example.com\nca_cert = /nonexistent/ca.crt\n'+CREDENTIALS)
+    with pytest.raises(SystemExit):
+        slc.read_config(path)
+
+
+@pytest.mark.parametrize('option', ['max_concurrency = 0', 'max_rps = -1', 'max_concurrency = lots'])
+def test_config_limits_are_validated(tmp_path, option):
+    path = write_config(tmp_path, '[sat]\nhostname = sat.example.com\n'+CREDENTIALS+option+'\n')
+    with pytest.raises(SystemExit):
+        slc.read_config(path)
+
+
+def test_hammer_config_keeps_credentials_private(mock_satellite):
+    server = mock_satellite().server
+    server.password = 'p"ss word'
+    path = slc.write_hammer_config(server)
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        with open(path) as config_file:
+            config = config_file.read()
+        assert ':password: "p\\"ss word"' in config
+        assert ':verify_ssl: false' in config
+    finally:
+        os.remove(path)
+
+
+def test_remote_hammer_gets_credentials_from_config_file(mock_satellite, monkeypatch):
+    server = mock_satellite().server
+    commands = []
+    monkeypatch.setattr(slc, 'hammer_enable_leapp_repos',
+                        lambda hammer, *args: commands.append((hammer, os.path.exists(hammer.split()[2]))))
+    slc.enable_leapp_repos(server, 1, 'x86_64', '8.10')
+    assert commands[0][0].startswith('hammer --config ')
+    assert commands[0][1]
+    assert 'changeme' not in commands[0][0]
+    assert not os.path.exists(commands[0][0].split()[2])
+
+
+def test_local_hammer_uses_its_own_config(mock_satellite, monkeypatch):
+    server = mock_satellite().server
+    server.local = True
+    commands = []
+    monkeypatch.setattr(slc, 'hammer_enable_leapp_repos', lambda hammer, *args: commands.append(hammer))
+    slc.enable_leapp_repos(server, 1, 'x86_64', '8.10')
+    assert commands == ['hammer ']